@@ -1,7 +1,7 @@
 from typing import TypedDict, List
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
+from llm_clients import get_chat
 from dotenv import load_dotenv
 # Load environment variables from a .env file
 load_dotenv()
@@ -11,12 +11,15 @@ class AgentState(TypedDict):
     message: List[HumanMessage]
 
 # Initialize the language model
-llm = ChatOpenAI(model="gpt-4", temperature=0)
+llm = get_chat("gpt-4", temperature=0)
 
 # Define the processing function for the agent
 def process_message(state: AgentState) -> None:
-    response = llm.invoke(state["message"])
-    print("Agent Response:", response.content)
+    # Stream the response so tokens are printed as soon as they arrive
+    print("Agent Response: ", end="", flush=True)
+    for chunk in llm.stream(state["message"]):
+        print(chunk.content, end="", flush=True)
+    print()
 
     return state
 
@@ -2,7 +2,7 @@ from dotenv import load_dotenv
 from typing import TypedDict, List, Union
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
+from llm_clients import get_chat
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -12,7 +12,7 @@ class AgentState(TypedDict):
     message: List[Union[HumanMessage, AIMessage]]
 
 # Initialize the language model
-llm = ChatOpenAI(model="gpt-4", temperature=0)
+llm = get_chat("gpt-4", temperature=0)
 
 # Define the processing function for the agent with memory
 def process_message(state: AgentState) -> AgentState:
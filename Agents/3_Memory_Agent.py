@@ -1,8 +1,17 @@
+import atexit
+import json
+import os
 from dotenv import load_dotenv
-from typing import TypedDict, List, Union
+from typing import TypedDict, List, Tuple, Union
 from langgraph.graph import StateGraph, START, END
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from llm_clients import get_chat
+
+# Use orjson to parse the log when it is installed, it is noticeably faster than json
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -12,16 +21,62 @@ class AgentState(TypedDict):
     message: List[Union[HumanMessage, AIMessage]]
 
 # Initialize the language model
-llm = ChatOpenAI(model="gpt-4", temperature=0)
+llm = get_chat("gpt-4", temperature=0)
+
+# Number of recent messages sent to the model verbatim; older ones are folded into the summary
+MAX_WINDOW_MESSAGES = 10
+
+# Rolling summary of the messages that have left the window
+conversation_summary = ""
+
+def summarize(summary: str, messages: List[Union[HumanMessage, AIMessage]]) -> str:
+    """Fold the given messages into the running conversation summary."""
+    # Pass the messages as a transcript in one request, so the model summarizes them
+    # instead of continuing the conversation
+    transcript = "\n".join(
+        f"{'User' if isinstance(message, HumanMessage) else 'AI'}: {message.content}" for message in messages
+    )
+    request = HumanMessage(content=(
+        "Summarize: update the summary of this conversation with the transcript below, in a few sentences, "
+        "keeping any facts about the user. Reply with the updated summary only.\n\n"
+        f"Current summary: {summary or 'None yet.'}\n\n"
+        f"Transcript:\n{transcript}"
+    ))
+    return llm.invoke([request]).content
 
 # Define the processing function for the agent with memory
 def process_message(state: AgentState) -> AgentState:
     """Process the incoming message and update the state with the response."""
-    response = llm.invoke(state["message"])
-    print("Agent Response:", response.content)
+    global conversation_summary # declare the variable as global to modify it
+
+    # Keep the context bounded: once the window overflows, fold its older half into the summary
+    # (summarizing in chunks means the extra summary call only happens every few turns)
+    if len(state["message"]) > MAX_WINDOW_MESSAGES:
+        keep = MAX_WINDOW_MESSAGES // 2
+        conversation_summary = summarize(conversation_summary, state["message"][:-keep])
+        del state["message"][:-keep]
+
+    context = list(state["message"])
+    if conversation_summary:
+        context.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {conversation_summary}"))
+
+    # Stream the response so tokens are printed as soon as they arrive
+    print("Agent Response: ", end="", flush=True)
+    chunks = []
+    for chunk in llm.stream(context):
+        print(chunk.content, end="", flush=True)
+        chunks.append(chunk.content)
+    print()
     
     # Append the AI's response to the message history
-    state["message"].append(AIMessage(content=response.content))
+    state["message"].append(AIMessage(content="".join(chunks)))
+
+    # Log the user's message and the AI's response as soon as the turn completes
+    conversation_log.append(state["message"][-2])
+    conversation_log.append(state["message"][-1])
+
+    # Persist the summary and the window so the next session starts from them
+    save_memory(MEMORY_FILE, conversation_summary, state["message"])
     
     return state
 
@@ -32,27 +87,121 @@ graph.add_edge(START, "process_message")
 graph.add_edge("process_message", END)
 agent = graph.compile()
 
+# Conversation log file, one JSON object per message (JSONL), only ever appended to
+LOG_FILE = "conversation_log.jsonl"
+
+# Log file used by earlier versions of this agent ("You: ..." / "AI: ..." lines)
+LEGACY_LOG_FILE = "logging.txt"
+
+# Maps the role stored in the log back to its message class
+ROLE_TO_MESSAGE = {"human": HumanMessage, "ai": AIMessage}
+
+def message_to_record(message: Union[HumanMessage, AIMessage]) -> dict:
+    """Convert a message into a JSON-serializable record."""
+    return {"role": "human" if isinstance(message, HumanMessage) else "ai", "content": message.content}
+
+def record_to_message(record: dict) -> Union[HumanMessage, AIMessage]:
+    """Convert a record from the log or memory file back into a message."""
+    return ROLE_TO_MESSAGE[record["role"]](content=record["content"])
+
+class ConversationLog:
+    """Appends messages to the JSONL conversation log file."""
+
+    def __init__(self, filename: str):
+        # Line buffered, so every message reaches the file as soon as it is written
+        self.file = open(filename, "a", buffering=1)
+        # If a crash cut off the last line, start on a fresh line so new messages stay readable
+        if self.file.tell() > 0:
+            with open(filename, "rb") as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b"\n":
+                    self.file.write("\n")
+        # Make sure the file is closed even if the loop exits unexpectedly
+        atexit.register(self.close)
+
+    def append(self, message: Union[HumanMessage, AIMessage]) -> None:
+        """Write a single message to the log."""
+        self.file.write(json.dumps(message_to_record(message)) + "\n")
+
+    def close(self) -> None:
+        """Close the log file."""
+        if not self.file.closed:
+            self.file.close()
+
 def load_conversation_from_file(filename: str) -> List[Union[HumanMessage, AIMessage]]:
-    """Load conversation history from a file."""
+    """Load conversation history from a JSONL file."""
     history = []
     try:
-        with open(filename, "r") as file:
-            lines = file.readlines()
-            for line in lines:
-                if line.startswith("You: "):
-                    content = line.replace("You: ", "")
-                    history.append(HumanMessage(content=content))
-                elif line.startswith("AI: "):
-                    content = line.replace("AI: ", "")
-                    history.append(AIMessage(content=content))
+        with open(filename, "rb") as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                # A crash can leave a half-written line behind: skip it and keep reading
+                try:
+                    history.append(record_to_message(json_loads(line)))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Skipping unreadable line {line_number} in {filename}: {e}")
     except FileNotFoundError:
         print(f"File not found: {filename}")
     except Exception as e:
         print(f"Error loading conversation history: {e}")
     return history
 
+def load_legacy_log(filename: str) -> List[Union[HumanMessage, AIMessage]]:
+    """Load conversation history from the old "You: " / "AI: " text log."""
+    history = []
+    with open(filename, "r") as file:
+        for line in file:
+            if line.startswith("You: "):
+                history.append(HumanMessage(content=line[len("You: "):].rstrip("\n")))
+            elif line.startswith("AI: "):
+                history.append(AIMessage(content=line[len("AI: "):].rstrip("\n")))
+    return history
+
+def migrate_legacy_log() -> None:
+    """Copy an old text log into the JSONL log, once, so earlier conversations carry over."""
+    if os.path.exists(LOG_FILE) or not os.path.exists(LEGACY_LOG_FILE):
+        return
+    history = load_legacy_log(LEGACY_LOG_FILE)
+    with open(LOG_FILE, "w") as file:
+        for message in history:
+            file.write(json.dumps(message_to_record(message)) + "\n")
+    print(f"Imported {len(history)} messages from {LEGACY_LOG_FILE} into {LOG_FILE}.")
+
+# File holding the rolling summary and the recent message window between sessions
+MEMORY_FILE = "memory.json"
+
+def save_memory(filename: str, summary: str, window: List[Union[HumanMessage, AIMessage]]) -> None:
+    """Save the conversation summary and the recent message window to a JSON file."""
+    data = {"summary": summary, "window": [message_to_record(message) for message in window]}
+    # Write to a temporary file and swap it in, so a crash mid-write never leaves a truncated file
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "w") as file:
+        json.dump(data, file)
+    os.replace(temp_filename, filename)
+
+def load_memory(filename: str) -> Tuple[str, List[Union[HumanMessage, AIMessage]]]:
+    """Load the conversation summary and the recent message window from a JSON file."""
+    with open(filename, "r") as file:
+        data = json.load(file)
+    return data["summary"], [record_to_message(record) for record in data["window"]]
+
+# Carry over the conversation from an older version's log file, if there is one
+migrate_legacy_log()
+
 # Initialize conversation history to maintain context
-conversation_history = load_conversation_from_file("logging.txt")
+try:
+    conversation_summary, conversation_history = load_memory(MEMORY_FILE)
+except FileNotFoundError:
+    # No saved memory yet: start from the tail of the conversation log
+    conversation_history = load_conversation_from_file(LOG_FILE)[-MAX_WINDOW_MESSAGES:]
+except (json.JSONDecodeError, KeyError) as e:
+    # Unreadable memory file: fall back to the tail of the conversation log as well
+    print(f"Error loading saved memory, starting from the conversation log: {e}")
+    conversation_history = load_conversation_from_file(LOG_FILE)[-MAX_WINDOW_MESSAGES:]
+
+# New messages are appended to the same file as the conversation goes on
+conversation_log = ConversationLog(LOG_FILE)
 
 # Example usage of the agent with memory
 user_input = input("Enter your message: ")
@@ -60,23 +209,13 @@ while user_input.lower() != "exit":
     conversation_history.append(HumanMessage(content=user_input))
     result = agent.invoke({"message": conversation_history})
 
-    # Update the conversation history with the latest state, because it includes the AI response
+    # Update the conversation history with the latest state, because it includes the AI response.
+    # process_message already trims it to the recent window and summarizes older messages.
     conversation_history = result["message"]
 
-    # Keep last 10 messages (5 user–AI pairs)
-    conversation_history = conversation_history[-10:]
-
     user_input = input("Enter your message: ")
 
-# Write the conversation history to a file
-with open("logging.txt", "w") as file:
-    file.write("Your Conversation Log:\n")
-    
-    for message in conversation_history:
-        if isinstance(message, HumanMessage):
-            file.write(f"You: {message.content}\n")
-        elif isinstance(message, AIMessage):
-            file.write(f"AI: {message.content}\n\n")
-    file.write("End of Conversation")
-
-print("Conversation saved to logging.txt")
+# Close the log file
+conversation_log.close()
+
+print(f"Conversation saved to {LOG_FILE}")
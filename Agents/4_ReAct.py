@@ -1,13 +1,16 @@
+import ast
+import asyncio
+import operator
 from dotenv import load_dotenv
 from typing import Annotated, Sequence, TypedDict # For type annotations and structured data types.
 from langchain_core.messages import BaseMessage # The foundation of all messages in LangChain.
 from langchain_core.messages import ToolMessage # Passes data back from tools to the LLM agent after tool execution.
 from langchain_core.messages import SystemMessage # Used to provide context or instructions to the LLM.
-from langchain_openai import ChatOpenAI 
+from llm_clients import get_chat # Shared, connection-pooled ChatOpenAI instances.
 from langchain_core.tools import tool # Decorator to define tools for the agent.
+from langchain_core.tools import ToolException # Tool errors that are reported back to the LLM.
 from langgraph.graph.message import add_messages # Reducer function to add messages to the state.
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode # Prebuilt node for tool execution.
 
 # Load environment variables from a .env file.
 load_dotenv()
@@ -17,47 +20,87 @@ class AgentState(TypedDict):
     """Defines the structure of the agent's state."""
     messages: Annotated[Sequence[BaseMessage], add_messages]
 
-# Define tools that adds two integers.
-@tool
-def add(a: int, b: int) -> int:
-    """This is a tool that adds two integers."""
-    return a + b
+# Arithmetic operators the calc tool is allowed to evaluate.
+ALLOWED_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
 
+def evaluate(node: ast.AST) -> float:
+    """Recursively evaluates a parsed arithmetic expression, rejecting anything else."""
+    if isinstance(node, ast.Expression):
+        return evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = evaluate(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in ALLOWED_OPERATORS:
+        left, right = evaluate(node.left), evaluate(node.right)
+        if isinstance(node.op, ast.Div) and right == 0:
+            return float('inf')  # Handle division by zero
+        return ALLOWED_OPERATORS[type(node.op)](left, right)
+    raise ToolException(f"Unsupported expression element: {type(node).__name__}")
+
+# Define a single tool that evaluates a whole arithmetic expression in one call.
 @tool
-def multiply(a: int, b: int) -> int:
-    """This is a tool that multiplies two integers."""
-    return a * b
+def calc(expression: str) -> float:
+    """This is a tool that evaluates an arithmetic expression using +, -, *, / and parentheses, e.g. "(30 + 12) * 6"."""
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise ToolException(f"Invalid expression: {e}")
+    return evaluate(tree)
 
-@tool
-def subtract(a: int, b: int) -> int:
-    """This is a tool that subtracts two integers."""
-    return a - b
-
-@tool
-def divide(a: int, b: int) -> float:
-    """This is a tool that divides two integers."""
-    if b == 0:
-        return float('inf')  # Handle division by zero
-    return a / b
+# Send invalid expressions back to the LLM as the tool result instead of raising.
+calc.handle_tool_error = True
 
 
 # Create a list of available tools for the agent.
-tools = [add, multiply, subtract, divide]
+tools = [calc]
 
 # Initialize the language model and bind the tools to it.
-model = ChatOpenAI(model="gpt-4").bind_tools(tools)
+model = get_chat("gpt-4").bind_tools(tools)
+
+# Look up tools by the name the LLM uses in its tool calls.
+tools_by_name = {t.name: t for t in tools}
 
 # Define the processing function for the ReAct agent.
-def model_call(state: AgentState) -> AgentState:
-    system_prompt = SystemMessage(content="You are my AI assistant, please answer my query to the best of your ability.")
-    response = model.invoke([system_prompt] + state["messages"])
+async def model_call(state: AgentState) -> AgentState:
+    system_prompt = SystemMessage(content=(
+        "You are my AI assistant, please answer my query to the best of your ability. "
+        "For arithmetic, pass the complete expression to the calc tool in a single call, e.g. (30 + 12) * 6."
+    ))
+    response = await model.ainvoke([system_prompt] + state["messages"])
     return {"messages": [response]}
 
+# Define a helper that runs a single tool call, rejecting tools the agent doesn't have.
+async def run_tool(tool_call: dict):
+    if tool_call["name"] not in tools_by_name:
+        return "Incorrect tool name, Please retry and select a valid tool from list of available tools."
+    return await tools_by_name[tool_call["name"]].ainvoke(tool_call["args"])
+
+# Define the tool node: runs every tool call from the last message concurrently.
+async def tool_node(state: AgentState) -> AgentState:
+    tool_calls = state["messages"][-1].tool_calls
+    # return_exceptions keeps one failing tool from aborting the others (and the graph)
+    results = await asyncio.gather(*[run_tool(tc) for tc in tool_calls], return_exceptions=True)
+    # one ToolMessage per result, in the same order as the tool calls
+    return {"messages": [
+        ToolMessage(
+            content=f"Error: {result!r}" if isinstance(result, Exception) else str(result),
+            name=tc["name"],
+            tool_call_id=tc["id"],
+        )
+        for tc, result in zip(tool_calls, results)
+    ]}
+
 # define the function to determine if the agent should continue or end.
 def should_continue(state: AgentState):
-    last_message = state["messages"][-1]
     # check if the last message contains any tool calls
-    if not last_message.tool_calls: 
+    if not getattr(state["messages"][-1], "tool_calls", None):
         return "end"
     return "continue"
 
@@ -65,7 +108,6 @@ def should_continue(state: AgentState):
 graph = StateGraph(AgentState)
 graph.add_node("our_agent", model_call)
 
-tool_node = ToolNode(tools=tools)
 graph.add_node("tools", tool_node)
 
 graph.set_entry_point("our_agent")
@@ -83,8 +125,8 @@ graph.add_edge("tools", "our_agent")
 app = graph.compile()
 
 # define a helper function to print the stream of messages
-def print_stream(stream):
-    for s in stream:
+async def print_stream(stream):
+    async for s in stream:
         message = s["messages"][-1]
         if isinstance(message, tuple):
             print(message) # if it’s a raw tuple like ("user", "text")
@@ -97,5 +139,5 @@ inputs = {
 }
 
 # Stream the agent's response and print it
-print_stream(app.stream(inputs, stream_mode="values")) # stream_mode can be "keys", "values", or "items"
+asyncio.run(print_stream(app.astream(inputs, stream_mode="values"))) # stream_mode can be "keys", "values", or "items"
 
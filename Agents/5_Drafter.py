@@ -1,16 +1,40 @@
+import atexit
+import io
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Annotated, Sequence, TypedDict
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage, ToolMessage
-from langchain_openai import ChatOpenAI
+from llm_clients import get_chat
 from langchain_core.tools import tool
 from langgraph.graph.message import add_messages
 
 load_dotenv()
 
-# This is a global variable storing document content
-document_content = ""
+# This is a global buffer storing document content
+_buf = io.StringIO()
+
+# Number of characters of the document shown to the model in the system prompt
+DOCUMENT_PREVIEW_CHARS = 512
+
+def get_content() -> str:
+    """Returns the current document content."""
+    return _buf.getvalue()
+
+def get_preview() -> str:
+    """Returns the start of the document, truncated to DOCUMENT_PREVIEW_CHARS."""
+    content = get_content()
+    return content[:DOCUMENT_PREVIEW_CHARS] + ("..." if len(content) > DOCUMENT_PREVIEW_CHARS else "")
+
+# Single background worker for file writes. run_document_agent waits for pending saves
+# before finishing, and shutting down with wait=True at exit guarantees they are written.
+_save_executor = ThreadPoolExecutor(max_workers=1)
+atexit.register(_save_executor.shutdown, wait=True)
+
+# Saves submitted to the worker, so their outcome can be reported when the run ends
+_pending_saves = []
 
 # ----------------------------- State Definition -----------------------------
 class AgentState(TypedDict):
@@ -18,12 +42,28 @@ class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
 
 # --------------------------------- Tools -------------------------------------
+def _write(filename: str, content: str) -> None:
+    """Writes the content to the file and reports the result (runs on the save worker)."""
+    try:
+        Path(filename).write_text(content)
+        print(f"\n 💾 Document successfully saved to {filename}.")
+    except Exception as e:
+        print(f"\n ❌ Error saving document to {filename}: {e}")
+
 @tool
 def update(content: str) -> str:
     """This tool updates the document with new content."""
-    global document_content # declare the variable as global to modify it
-    document_content = content
-    return f"Document successfully updated. Current content is: {document_content}"
+    # Replace the buffer contents in place
+    _buf.seek(0)
+    _buf.truncate()
+    _buf.write(content)
+    # Return a short confirmation; the full text stays out of the conversation (see get_document)
+    return f"Document successfully updated ({len(content)} characters). Preview: {get_preview()}"
+
+@tool
+def get_document() -> str:
+    """This tool returns the full current document content."""
+    return get_content()
 
 @tool
 def save(filename: str) -> str:
@@ -31,34 +71,36 @@ def save(filename: str) -> str:
     
     Args:
         filename (str): The name of the text file to save the content to."""
-    global document_content
 
     if not filename.endswith(".txt"):
        filename += ".txt"
     
+    # Hand the write to the background worker; the result is reported when the run ends
     try:
-        with open(filename, "w") as file:
-            file.write(document_content)
-        print(f"\n 💾 Document successfully saved to {filename}.")
-        return f"Document successfully saved to {filename}."
+        _pending_saves.append(_save_executor.submit(_write, filename, get_content()))
+        return f"Saving document to {filename}."
     except Exception as e:
         return f"Error saving document: {e}"
 
-tools = [update, save]
+tools = [update, get_document, save]
 
 # ----------------------------- Model Setup ------------------------------
-model = ChatOpenAI(model="gpt-4").bind_tools(tools)
+model = get_chat("gpt-4").bind_tools(tools)
 
 # ----------------------------- Agent Logic -----------------------------
 def our_agent(state: AgentState) -> AgentState:
+    # Only a preview goes into the prompt, so its size doesn't grow with the document
+    preview = get_preview()
+
     system_prompt = SystemMessage(content=f"""
         You are Drafter, a helpful writing assistant. You are going to help the user update and modify documents.
         
         - If the user wants to update or modify content, use the 'update' tool with the complete updated content.
+        - If you need the full document (only a preview is shown below), use the 'get_document' tool.
         - If the user wants to save and finish, you need to use the 'save' tool.
         - Make sure to always show the current document state after modifications.
         
-        The current document content is:{document_content}
+        Preview of the current document content:{preview}
         """)
     
     if not state["messages"]:
@@ -77,7 +119,7 @@ def our_agent(state: AgentState) -> AgentState:
     response = model.invoke(all_messages)
 
     print(f"\n🤖 AI: {response.content}")
-    if hasattr(response, "tool_calls") and response.tool_calls:
+    if getattr(response, "tool_calls", None):
         print(f"🔧 USING TOOLS: {[tc['name'] for tc in response.tool_calls]}")
 
     # Add the new messages to the state and return it.
@@ -93,11 +135,12 @@ def should_continue(state: AgentState) -> str:
     if not messages:
         return "continue"
 
-    # Scan messages in reverse (latest first)
+    # Scan only the tool results from the latest step (latest first) and stop at the agent's
+    # message, so older results or document text can't end the run
     for message in reversed(messages):
-        if (isinstance(message, ToolMessage) and 
-            "saved" in message.content.lower() and
-            "document" in message.content.lower()):
+        if not isinstance(message, ToolMessage):
+            break
+        if message.name == "save" and message.content.startswith("Saving document to"):
             return "end" # goes to the end edge which leads to the endpoint
         
     return "continue"
@@ -138,6 +181,10 @@ def run_document_agent():
     for step in app.stream(state, stream_mode="values"):
         if "messages" in step:
             print_messages(step["messages"])
+
+    # Wait for pending saves so their success or failure is shown before finishing
+    for future in _pending_saves:
+        future.result()
     
     print("\n ===== DRAFTER FINISHED =====")
 
@@ -1,11 +1,18 @@
 import os
+import glob
+import pickle
+import asyncio
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, Annotated, Sequence
+from typing import TypedDict, Annotated, Sequence, List, Optional, Tuple
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, ToolMessage
+from langchain_core.documents import Document
 from operator import add as add_messages
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
+from llm_clients import get_chat, get_embeddings
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
@@ -15,68 +22,206 @@ from langchain_core.tools import tool
 load_dotenv()
 
 # ------------------------------ Model and Embeddings Setup -------------------------------
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+llm = get_chat("gpt-4o", temperature=0)
+
+# text-embedding-3 models can return shortened vectors; 512 dimensions instead of the full 1536
+# make the store 3x smaller and similarity search faster, with little loss in retrieval quality
+EMBEDDING_DIMENSIONS = 512
+embeddings = get_embeddings("text-embedding-3-small", dimensions=EMBEDDING_DIMENSIONS)
 
 # --------------------------------- Paths and Directories ---------------------------------
 current_dir = os.path.dirname(os.path.abspath(__file__))
 persist_directory = os.path.join(current_dir, "chroma_db")
 pdf_path = os.path.join(current_dir, "Stock_Market_Performance_2024.pdf")
-collection_name = "pdf_collection"
+# One collection per vector size, so vectors of different dimensions are never mixed
+collection_name = f"pdf_collection_{EMBEDDING_DIMENSIONS}d"
 
 if not os.path.exists(pdf_path):
     raise FileNotFoundError(f"The file {pdf_path} does not exist. Please provide a valid PDF file.")
 
-# ----------------------------------- Load PDF Document -----------------------------------
-pdf_loader = PyPDFLoader(pdf_path)
+if not os.path.exists(persist_directory):
+    os.makedirs(persist_directory)
 
-try:
-    documents = pdf_loader.load()
-    print(f"Loaded {len(documents)} pages from the PDF.")
-except Exception as e:
-    raise RuntimeError(f"Failed to load PDF: {e}")
+# Hash of the PDF that the persisted collection was last built from
+ingest_hash_path = os.path.join(persist_directory, f".ingest_hash-{collection_name}")
+with open(pdf_path, "rb") as file:
+    pdf_hash = hashlib.sha256(file.read()).hexdigest()
+
+stored_hash = None
+if os.path.exists(ingest_hash_path):
+    with open(ingest_hash_path, "r") as file:
+        stored_hash = file.read().strip()
 
 # ----------------------------------- Text Splitting --------------------------------------
+# Built once and reused for every page (and every PDF, if more are added)
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-texts = text_splitter.split_documents(documents)
 
-if not os.path.exists(persist_directory):
-    os.makedirs(persist_directory)
+# Splitting is mostly pure Python and held back by the GIL, so a few threads are enough
+SPLIT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+@lru_cache(maxsize=1024)
+def _split_cached(text: str) -> Tuple[str, ...]:
+    """Splits a page's text into chunks; identical pages in the same run are split only once."""
+    return tuple(text_splitter.split_text(text))
+
+def split_documents(documents: List[Document]) -> List[Document]:
+    """Splits the pages in a thread pool and returns the chunks in page order."""
+
+    def split_page(page: Document) -> List[Document]:
+        return [
+            Document(page_content=chunk, metadata=dict(page.metadata))
+            for chunk in _split_cached(page.page_content)
+        ]
+
+    with ThreadPoolExecutor(max_workers=SPLIT_MAX_WORKERS) as executor:
+        return [chunk for chunks in executor.map(split_page, documents) for chunk in chunks]
+
+# ---------------------------------- Batched Embedding ------------------------------------
+EMBED_BATCH_SIZE = 512      # Chunks per embeddings request (OpenAI accepts up to 2048 inputs)
+EMBED_MAX_CONCURRENCY = 4   # Embeddings requests allowed in flight at once
+
+async def embed_in_batches(texts: List[str]) -> List[List[float]]:
+    """Embeds the texts in concurrent batches and returns the vectors in the same order."""
+    semaphore = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
+
+    async def embed_batch(batch: List[str]) -> List[List[float]]:
+        async with semaphore:
+            # Uses the shared sync client in a worker thread: this ingest runs in its own
+            # event loop, and async connections pooled here would be unusable once it closes
+            return await asyncio.to_thread(embeddings.embed_documents, batch)
+
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    vectors = await asyncio.gather(*[embed_batch(batch) for batch in batches])
+    return [vector for batch in vectors for vector in batch]
 
 # ------------------------------- Create or Load Vector Store -----------------------------
 try:
-    vectorstore = Chroma.from_documents(
-        documents=texts,
-        embedding=embeddings,
+    vectorstore = Chroma(
         persist_directory=persist_directory,
+        embedding_function=embeddings,
         collection_name=collection_name
     )
-    print(f"Created vector store with {len(texts)} documents.")
 except Exception as e:
     print(f"Error creating vector store: {e}")
     raise RuntimeError(f"Failed to create vector store: {e}")
 
+if stored_hash == pdf_hash:
+    print("PDF unchanged, reusing the existing vector store.")
+else:
+    # ------------------------------- Load PDF Document -----------------------------------
+    # Parsed pages are cached as a pickle keyed on the same content hash as the ingest hash file,
+    # so the cached pages always belong to the PDF whose hash gets recorded
+    documents_cache_path = os.path.join(persist_directory, f"docs-{pdf_hash}.pkl")
+
+    if os.path.exists(documents_cache_path):
+        # pickle.load runs whatever code the file contains, so chroma_db/ must be a trusted directory
+        with open(documents_cache_path, "rb") as file:
+            documents = pickle.load(file)
+        print(f"Loaded {len(documents)} cached pages for the PDF.")
+    else:
+        pdf_loader = PyPDFLoader(pdf_path)
+
+        try:
+            documents = pdf_loader.load()
+            print(f"Loaded {len(documents)} pages from the PDF.")
+        except Exception as e:
+            raise RuntimeError(f"Failed to load PDF: {e}")
+
+        # Replace any cache left over from an older version of the PDF
+        for old_cache_path in glob.glob(os.path.join(persist_directory, "docs-*.pkl")):
+            os.remove(old_cache_path)
+        with open(documents_cache_path, "wb") as file:
+            pickle.dump(documents, file, protocol=5)
+
+    # --------------------------------- Text Splitting ------------------------------------
+    texts = split_documents(documents)
+
+    # ------------------------- Embed Only New or Changed Chunks --------------------------
+    # Each chunk is keyed by the hash of its text, so unchanged chunks are never re-embedded.
+    # Repeated texts (headers, boilerplate) get an occurrence suffix so each keeps its own metadata.
+    chunks = {}
+    occurrences = defaultdict(int)
+    for text in texts:
+        text_hash = hashlib.sha256(text.page_content.encode()).hexdigest()
+        chunks[f"{text_hash}-{occurrences[text_hash]}"] = text
+        occurrences[text_hash] += 1
+
+    try:
+        stored_ids = set(vectorstore.get(include=[])["ids"])
+
+        stale_ids = list(stored_ids - chunks.keys())
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+
+        # Kept chunks have the same text, but may now sit on a different page (or an id may now
+        # refer to a different occurrence), so refresh their metadata to match the current PDF
+        kept_ids = [chunk_id for chunk_id in chunks if chunk_id in stored_ids]
+        if kept_ids:
+            vectorstore._collection.update(
+                ids=kept_ids,
+                metadatas=[chunks[chunk_id].metadata for chunk_id in kept_ids]
+            )
+
+        new_ids = [chunk_id for chunk_id in chunks if chunk_id not in stored_ids]
+        if new_ids:
+            new_chunks = [chunks[chunk_id] for chunk_id in new_ids]
+
+            # Embed each distinct text once and reuse its vector for the duplicates
+            unique_texts = list(dict.fromkeys(chunk.page_content for chunk in new_chunks))
+            unique_vectors = asyncio.run(embed_in_batches(unique_texts))
+            vector_by_text = dict(zip(unique_texts, unique_vectors))
+            vectors = [vector_by_text[chunk.page_content] for chunk in new_chunks]
+            vectorstore._collection.add(
+                ids=new_ids,
+                embeddings=vectors,
+                documents=[chunk.page_content for chunk in new_chunks],
+                metadatas=[chunk.metadata for chunk in new_chunks]
+            )
+        print(f"Vector store has {len(chunks)} chunks ({len(new_ids)} added, {len(stale_ids)} removed).")
+    except Exception as e:
+        print(f"Error updating vector store: {e}")
+        raise RuntimeError(f"Failed to update vector store: {e}")
+
+    with open(ingest_hash_path, "w") as file:
+        file.write(pdf_hash)
+
+    # Remove collections (and their hash files) left from other vector sizes, e.g. the
+    # original full-size "pdf_collection", so they don't keep taking up space on disk
+    for collection in vectorstore._client.list_collections():
+        # Newer Chroma versions return names, older ones return collection objects
+        name = getattr(collection, "name", collection)
+        if name.startswith("pdf_collection") and name != collection_name:
+            vectorstore._client.delete_collection(name)
+            print(f"Removed old collection {name}.")
+    for old_hash_path in glob.glob(os.path.join(persist_directory, ".ingest_hash*")):
+        if old_hash_path != ingest_hash_path:
+            os.remove(old_hash_path)
+
 # ------------------------------------ Retriever Setup ------------------------------------
-retriever = vectorstore.as_retriever(
-    search_type="similarity",
-    search_kwargs={"k": 5}  # Retrieve top 5 similar documents
-)
+# Cache query embeddings so repeated queries skip the embeddings API round-trip
+_embed_query = lru_cache(maxsize=1024)(embeddings.embed_query)
 
-# ------------------------------------ Tool Definition ------------------------------------
-@tool
-def retrieve(query: str) -> str:
-    """This tool retrieves relevant information from the PDF based on the user's query."""
-    
-    docs = retriever.invoke(query)
+# Maximum number of characters kept from each retrieved chunk
+MAX_RESULT_CHARS = 1500
+
+@lru_cache(maxsize=256)
+def _retrieve_cached(query_norm: str) -> str:
+    """Runs the similarity search for a normalized query and formats the top 5 results."""
+    docs = vectorstore.similarity_search_by_vector(_embed_query(query_norm), k=5)
 
     if not docs:
         return "No relevant information found in the document."
 
-    results = []
-    for i, doc in enumerate(docs):
-        results.append(f"Result {i+1}:\n{doc.page_content}\n")
+    # Cap each result so the retrieved context doesn't inflate every later LLM call
+    return "\n\n".join(
+        f"Result {i}:\n{doc.page_content[:MAX_RESULT_CHARS]}" for i, doc in enumerate(docs, 1)
+    )
 
-    return "\n\n".join(results)
+# ------------------------------------ Tool Definition ------------------------------------
+@tool
+def retrieve(query: str) -> str:
+    """This tool retrieves relevant information from the PDF based on the user's query."""
+    return _retrieve_cached(query.strip().lower())
 
 
 tools = [retrieve]
@@ -90,9 +235,8 @@ class AgentState(TypedDict):
 # -------------------------------- Control Flow Logic -------------------------------------
 def should_continue(state: AgentState) -> bool:
     """Determines whether the agent should continue or end the conversation."""
-    last_message = state["messages"][-1]
     # Continue if the last message has tool calls
-    return hasattr(last_message, "tool_calls") and len(last_message.tool_calls) > 0
+    return bool(getattr(state["messages"][-1], "tool_calls", None))
 
 
 # -------------------------- System Prompt and Tools Dictionary ---------------------------
@@ -103,37 +247,53 @@ If you need to look up some information before asking a follow up question, you
 Please always cite the specific parts of the documents you use in your answers.
 """
 
+# Built once so every call shares the same leading message (keeps the prompt-cache prefix stable)
+SYSTEM_MSG = SystemMessage(content=system_prompt)
+
 # ------------------------------------- Agent Logic ---------------------------------------
-def call_llm(state: AgentState) -> AgentState:
+async def call_llm(state: AgentState) -> AgentState:
     """Calls the LLM with the current state and system prompt."""
-    messages = list(state['messages'])
-    messages = [SystemMessage(content=system_prompt)] + messages
-    message = model.invoke(messages)
+    message = await model.ainvoke([SYSTEM_MSG, *state['messages']])
     return {'messages': [message]}
 
 # --------------------------------- Tool Execution Logic ----------------------------------
 tools_dict = {our_tool.name: our_tool for our_tool in tools} 
 
-def take_action(state: AgentState) -> AgentState:
-    """Executes tool calls from LLM's response"""
+async def take_action(state: AgentState) -> AgentState:
+    """Executes tool calls from LLM's response, running all retrievals concurrently"""
     tool_calls = state['messages'][-1].tool_calls
-    results = []
-    for t in tool_calls:
-        print(f"🔧 Calling tool: {t['name']} with query: {t['args'].get('query', 'No query provided')}")
 
+    async def run_tool(t: dict) -> Optional[str]:
         if not t['name'] in tools_dict:
             print(f"Tool {t['name']} does not exist.")
+            return None
+        return str(await tools_dict[t['name']].ainvoke(t['args'].get('query', '')))
+
+    for t in tool_calls:
+        print(f"🔧 Calling tool: {t['name']} with query: {t['args'].get('query') or 'No query provided'}")
+    outputs = await asyncio.gather(*[run_tool(t) for t in tool_calls])
+
+    results = []
+    context = []
+    for t, retrieved in zip(tool_calls, outputs):
+        query = t['args'].get('query', '')
+
+        if retrieved is None:
             result = "Incorrect tool name, Please retry and select a valid tool from list of available tools."
 
         else:
-            result = tools_dict[t['name']].invoke(t['args'].get('query', ''))
-            print(f"Result length: {len(str(result))} characters")
+            print(f"Result length: {len(retrieved)} characters")
+
+            # Keep the tool message short and move the retrieved text into a trailing message
+            result = f"Retrieved results for '{query}' are provided in the following message."
+            context.append(HumanMessage(content=f"Retrieved context for '{query}':\n\n{retrieved}"))
 
         # Append the tool message and the result to the state
-        results.append(ToolMessage(content=str(result), name=t['name'], tool_call_id=t['id']))
+        results.append(ToolMessage(content=result, name=t['name'], tool_call_id=t['id']))
 
     print(f"🔧 Finished all tool calls.")
-    return {'messages': results}
+    # Tool messages must directly follow the AI message that requested them
+    return {'messages': results + context}
 
 
 # ------------------------------------- Build the Graph -----------------------------------
@@ -153,20 +313,27 @@ graph.set_entry_point("llm")
 rag_agent = graph.compile()
 
 # ------------------------------------- Run the Agent --------------------------------------
-def running_agent():
+async def stream_answer(messages: List[BaseMessage]) -> None:
+    """Runs the agent and prints the LLM's answer token by token as it is generated."""
+    print("\n=== ANSWER ===")
+    async for chunk, metadata in rag_agent.astream({"messages": messages}, stream_mode="messages"):
+        # Only print tokens from the LLM node, not the tool and context messages
+        if metadata.get("langgraph_node") == "llm" and chunk.content:
+            print(chunk.content, end="", flush=True)
+    print()
+
+async def running_agent():
     print("\n=== RAG AGENT===")
     
+    # The whole session runs in one event loop, so pooled async connections stay usable
     while True:
-        user_input = input("\nWhat is your question: ")
+        user_input = await asyncio.to_thread(input, "\nWhat is your question: ")
         if user_input.lower() in ['exit', 'quit']:
             break
             
         messages = [HumanMessage(content=user_input)] # converts back to a HumanMessage type
 
-        result = rag_agent.invoke({"messages": messages})
-        
-        print("\n=== ANSWER ===")
-        print(result['messages'][-1].content)
+        await stream_answer(messages)
 
 
-running_agent()
\ No newline at end of file
+asyncio.run(running_agent())
\ No newline at end of file
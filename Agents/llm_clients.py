@@ -0,0 +1,20 @@
+import functools
+from openai import DefaultHttpxClient
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+@functools.lru_cache(maxsize=1)
+def get_http_client() -> DefaultHttpxClient:
+    """Returns the pooled HTTP client shared by every model and embeddings instance,
+    so connections (and their TLS handshakes) are reused across agents. It keeps the
+    OpenAI SDK's own client defaults (connection limits, timeouts, redirects)."""
+    return DefaultHttpxClient()
+
+@functools.lru_cache(maxsize=8)
+def get_chat(model: str = "gpt-4", **kwargs) -> ChatOpenAI:
+    """Returns a shared ChatOpenAI instance for the given model and settings."""
+    return ChatOpenAI(model=model, http_client=get_http_client(), **kwargs)
+
+@functools.lru_cache(maxsize=8)
+def get_embeddings(model: str = "text-embedding-3-small", **kwargs) -> OpenAIEmbeddings:
+    """Returns a shared OpenAIEmbeddings instance for the given model and settings."""
+    return OpenAIEmbeddings(model=model, http_client=get_http_client(), **kwargs)